@@ -1,10 +1,14 @@
 import telebot
 import re
 
-from settings import TELEBOT_TOKEN
+from settings import TELEBOT_TOKEN, BOT_NUM_THREADS
 from extensions import API, APIException
 
-bot = telebot.TeleBot(TELEBOT_TOKEN)
+# формат запроса на конвертацию: <целевая валюта> <конвертируемая валюта> <сумма в целевой валюте>
+_QUERY_RE = re.compile(r'^\s*<([^>]+)>\s*<([^>]+)>\s+<([^>]+)>\s*$')
+
+# обработчики выполняются в пуле потоков, чтобы медленный запрос не задерживал остальных пользователей
+bot = telebot.TeleBot(TELEBOT_TOKEN, threaded=True, num_threads=BOT_NUM_THREADS)
 
 @bot.message_handler(commands=['help', 'start'])
 def send_welcome(message):
@@ -49,23 +53,20 @@ def send_rates(message):
     """
     bot.send_message(message.chat.id, API.get_rates())
 
-@bot.message_handler(func=lambda message: True)
+@bot.message_handler(content_types=['text'])
 def handle_message(message):
     """
     отправка результата конвертации валют
     :param message: object
     :return: None
     """
-    try:
-        regex = r'^\s*<([^>]+)>\s*<([^>]+)>\s<([^>]+)>\s*$'
-        match = re.match(regex, message.text)
-        if match is None:
-            raise APIException(f"Некорректный формат запроса на конвертацию валют ({APIException.__name__})")
+    match = _QUERY_RE.match(message.text)
+    if match is None:
+        bot.send_message(message.chat.id, f"Некорректный формат запроса на конвертацию валют ({APIException.__name__})")
+        return
 
-        bot.send_message(message.chat.id, API.get_price(match[1], match[2], match[3]))
-    except APIException as e:
-        bot.send_message(message.chat.id, e)
+    bot.send_message(message.chat.id, API.get_price(match[1], match[2], match[3]))
 
 
-bot.infinity_polling()
+bot.infinity_polling(skip_pending=True)
 
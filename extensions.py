@@ -1,20 +1,32 @@
-from Levenshtein import distance
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+from bisect import bisect_left, bisect_right
+import functools
+import sys
+import threading
 import requests
-import copy
-from datetime import datetime
-import xml.etree.ElementTree as ETree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta
+from types import MappingProxyType
+from io import BytesIO
+from lxml import etree
 
-from settings import CURRENCIES_VOC_URL, RATES_URL_PREFIX
+from settings import CURRENCIES_VOC_URL, RATES_URL_PREFIX, HTTP_TIMEOUT, \
+    RATES_REFRESH_OFFSET, RATES_REFRESH_RETRY_DELAY, RATES_REFRESH_CHECK_INTERVAL
+
+# максимальное расстояние Левенштейна, при котором название считается опечаткой
+MAX_LEV_DISTANCE = 3
+
+# общая HTTP-сессия: keep-alive и пул соединений избавляют от повторного TLS-рукопожатия с cbr.ru
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4,
+                                    max_retries=Retry(total=3, backoff_factor=0.5)))
 
 class APIException(Exception):
     """
     класс ошибок при работе с ботом
     """
-    def __init__(self, message: str):
-        self._message = message
-
-    def __str__(self):
-        return self._message
 
 class API:
     """
@@ -29,58 +41,64 @@ class API:
         :param amount: количество валюты, в которую конвертируем
         :return: str
         """
+        # ошибки пользователя возвращаются сразу, без возбуждения и перехвата исключений;
+        # APIException перехватывается только при сбое получения данных с сайта ЦБ РФ
         try:
-            if not hasattr(API, 'storage'):
-                API.storage = RatesStorage()
+            amount = float(amount)
+        except ValueError:
+            return f"Количество целевой валюты должно быть числом ({ValueError.__name__})"
 
-            try:
-                amount = float(amount)
-            except ValueError:
-                raise APIException(f"Количество целевой валюты должно быть числом ({ValueError.__name__})")
+        if amount <= 0:
+            return f"Количество целевой валюты должно быть больше нуля ({ValueError.__name__})"
 
-            if amount <= 0:
-                raise APIException(f"Количество целевой валюты должно быть больше нуля ({ValueError.__name__})")
+        try:
+            # обе валюты и курсы берутся из одного снимка, чтобы ответ не смешивал данные за разные дни
+            snapshot = STORAGE.snapshot
 
-            base_data = API.storage.get_currency_data(base)
+            base_data = STORAGE.get_currency_data(base, snapshot)
             if base_data is None:
-                raise APIException(f"Не найдена целевая валюта, название или код которой соответствуют запросу {base} ({APIException.__name__})")
+                return f"Не найдена целевая валюта, название или код которой соответствуют запросу {base} ({APIException.__name__})"
 
-            quote_data = API.storage.get_currency_data(quote)
+            quote_data = STORAGE.get_currency_data(quote, snapshot)
             if quote_data is None:
-                raise APIException(f"Не найдена конвертируемая валюта, название или код которой соответствуют запросу {quote} ({APIException.__name__})")
+                return f"Не найдена конвертируемая валюта, название или код которой соответствуют запросу {quote} ({APIException.__name__})"
 
             if base_data['code'] == quote_data['code']:
-                raise APIException(f"Целевая валюта должна отличаться от конвертируемой ({APIException.__name__})")
+                return f"Целевая валюта должна отличаться от конвертируемой ({APIException.__name__})"
 
-            base_quantity = round(base_data['rub_rate'] / quote_data['rub_rate'] * amount, 2)
-
-            return (f"Стоимость {amount}  {base_data['code']} ({base_data['rus_name']}/{base_data['eng_name']}) "
-                    f"составляет {base_quantity} {quote_data['code']} ({quote_data['rus_name']}/{quote_data['eng_name']})")
+            return API._format_quote(snapshot, base_data['code'], quote_data['code'], amount)
         except APIException as e:
             return (f"{e}")
 
     @staticmethod
-    def get_vocabulary():
+    @functools.lru_cache(maxsize=256)
+    def _format_quote(snapshot, base_code: str, quote_code: str, amount: float):
         """
-        обработчик запроса к боту на получение информации о словаре валют
+        формирует ответ на запрос конвертации; результат кэшируется, так как курсы неизменны в течение суток,
+        а популярные пары валют запрашиваются многократно (снимок входит в ключ кэша,
+        а сам кэш очищается при публикации нового снимка, см. RatesStorage.fill)
+        :param snapshot: снимок данных хранилища, в котором были найдены валюты
+        :param base_code: код валюты, в которую конвертируем
+        :param quote_code: код валюты, которая конвертируется
+        :param amount: количество валюты, в которую конвертируем
         :return: str
         """
-        try:
-            rows = []
-
-            if not hasattr(API, 'storage'):
-                API.storage = RatesStorage()
+        base_data = snapshot.by_code[base_code]
+        quote_data = snapshot.by_code[quote_code]
 
-            rows.append('СПРАВОЧНИК ВАЛЮТ')
-            rows.append('(Код валюты, русское и английское названия)')
-            rows.append('-----------------------------------------------------------')
+        base_quantity = round(base_data['rub_rate'] / quote_data['rub_rate'] * amount, 2)
 
-            for item in API.storage.data:
-                rows.append(f"{item['code']}, {item['rus_name']}, {item['eng_name']}")
+        return (f"Стоимость {amount}  {base_data['code']} ({base_data['rus_name']}/{base_data['eng_name']}) "
+                f"составляет {base_quantity} {quote_data['code']} ({quote_data['rus_name']}/{quote_data['eng_name']})")
 
-            rows.append('-----------------------------------------------------------')
-            rows.append("Чтобы вывести справку, наберите /start или /help")
-            return "\n".join(rows)
+    @staticmethod
+    def get_vocabulary():
+        """
+        обработчик запроса к боту на получение информации о словаре валют
+        :return: str
+        """
+        try:
+            return STORAGE.vocabulary_text
 
         except APIException as e:
             return (f"{e}")
@@ -93,35 +111,58 @@ class API:
         """
 
         try:
-            rows = []
-
-            if not hasattr(API, 'storage'):
-                API.storage = RatesStorage()
-
-            rows.append(f'КОТИРОВКИ ВАЛЮТ ЦБ РФ на {API.storage.cached_date}')
-            rows.append('(Код валюты, курс руб/ед.)')
-            rows.append('-----------------------------------------------------------')
-
-            for item in API.storage.data:
-                rows.append(f"{item['code']}, {item['rub_rate']}")
-
-            rows.append('-----------------------------------------------------------')
-            rows.append("Чтобы вывести справку, наберите /start или /help")
-            return "\n".join(rows)
+            return STORAGE.rates_text
 
         except APIException as e:
             return (f"{e}")
 
 
+class RatesSnapshot:
+    """
+    неизменяемый снимок данных хранилища за одни сутки: записи о валютах и все производные от них структуры.
+    Снимок публикуется в хранилище одним присваиванием, поэтому читатель, взявший ссылку на снимок,
+    не может получить смесь данных за разные дни
+    """
+    __slots__ = ("data", "index", "by_code", "fuzzy_choices", "fuzzy_owners", "fuzzy_positions", "fuzzy_lengths",
+                 "vocabulary_text", "rates_text", "cached_date", "version")
+
+    def __init__(self, data, index, by_code, fuzzy_choices, fuzzy_owners, fuzzy_positions, fuzzy_lengths,
+                 vocabulary_text, rates_text, cached_date, version):
+        self.data = data
+        self.index = index
+        self.by_code = by_code
+        self.fuzzy_choices = fuzzy_choices
+        self.fuzzy_owners = fuzzy_owners
+        self.fuzzy_positions = fuzzy_positions
+        self.fuzzy_lengths = fuzzy_lengths
+        self.vocabulary_text = vocabulary_text
+        self.rates_text = rates_text
+        self.cached_date = cached_date
+        self.version = version
+
+
+# пустой снимок, с которого начинает хранилище; версия 0 означает, что данные еще не загружались
+_EMPTY_SNAPSHOT = RatesSnapshot(data=(), index={}, by_code={}, fuzzy_choices=[], fuzzy_owners=[],
+                                fuzzy_positions=[], fuzzy_lengths=[],
+                                vocabulary_text="", rates_text="", cached_date=None, version=0)
+
+
 class RatesStorage:
     """
     класс-хранилище информации о курсах валют
     """
+    __slots__ = ("_snapshot", "_lock", "_refresh_event", "_stop_event", "_refresher")
+
     def __init__(self):
-        self._data_write_only = []
-        self._data_read_only = []
-        self._cached_date = None
-        self.fill()
+        self._snapshot = _EMPTY_SNAPSHOT
+        self._lock = threading.Lock()
+
+        # за актуальность данных отвечает фоновый поток: он заполняет хранилище при запуске,
+        # а затем ежедневно вскоре после полуночи, не задерживая обработку сообщений
+        self._refresh_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="rates-refresher", daemon=True)
+        self._refresher.start()
 
     @staticmethod
     def current_date() -> str:
@@ -131,35 +172,126 @@ class RatesStorage:
         """
         return datetime.now().strftime("%d/%m/%Y")
 
+    @staticmethod
+    def seconds_until_refresh() -> float:
+        """
+        Возвращает число секунд до ближайшего планового обновления курсов
+        (RATES_REFRESH_OFFSET секунд после локальной полуночи); время вычисляется по текущему
+        часовому поясу системы при каждом вызове, поэтому переход на летнее/зимнее время учитывается
+        :return: float
+        """
+        now = datetime.now().astimezone()
+        refresh_at = now.replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0) \
+            + timedelta(seconds=RATES_REFRESH_OFFSET)
+        if refresh_at.astimezone() <= now:
+            refresh_at += timedelta(days=1)
+        return (refresh_at.astimezone() - now).total_seconds()
+
     @property
     def cached_date(self):
-        return self._cached_date
+        return self._snapshot.cached_date
+
+    @property
+    def snapshot(self):
+        """
+        Возвращает текущий снимок данных; читателю, которому нужны согласованные данные,
+        следует один раз взять снимок и дальше работать только с ним.
+        Побочный эффект: если хранилище еще не заполнено, заполняет его.
+        :return: RatesSnapshot
+        """
+        self.actualize()
+        return self._snapshot
 
     @property
     def data(self):
         """
-        Возвращает содержимое хранилища, защищая оригинальный кэш от изменения (см. deepcopy).
-        Побочный эффект: если кэш протух, актуализирует его.
-        :return: list[dict]
+        Возвращает содержимое хранилища без копирования: при заполнении записи заморожены (MappingProxyType),
+        а их набор сохранен в кортеже, поэтому изменить оригинальный кэш нельзя.
+        Побочный эффект: если хранилище еще не заполнено, заполняет его.
+        :return: tuple[MappingProxyType]
         """
+        return self.snapshot.data
 
-        def lists_match(l1, l2):
-            if len(l1) != len(l2):
-                return False
-            return all(x == y and type(x) == type(y) for x, y in zip(l1, l2))
+    @property
+    def vocabulary_text(self):
+        """
+        Возвращает справочник валют в виде текста, подготовленного при заполнении хранилища.
+        Побочный эффект: если хранилище еще не заполнено, заполняет его.
+        :return: str
+        """
+        return self.snapshot.vocabulary_text
 
-        if RatesStorage.current_date() != self._cached_date:
-            self.fill()
+    @property
+    def rates_text(self):
+        """
+        Возвращает котировки валют в виде текста, подготовленного при заполнении хранилища.
+        Побочный эффект: если хранилище еще не заполнено, заполняет его.
+        :return: str
+        """
+        return self.snapshot.rates_text
 
-        if not lists_match(self._data_write_only, self._data_read_only):
-            self._data_read_only = copy.deepcopy(self._data_write_only)
+    @property
+    def loaded(self):
+        """
+        Возвращает признак того, что хранилище хотя бы раз было успешно заполнено
+        :return: bool
+        """
+        return self._snapshot.version != 0
 
-        return self._data_read_only
+    def actualize(self):
+        """
+        если хранилище еще ни разу не было заполнено (например, первый запрос пришел раньше,
+        чем фоновый поток успел получить данные), заполняет его; дальнейшие обновления выполняет фоновый поток.
+        Блокировка не дает нескольким потокам одновременно запрашивать данные с сайта ЦБ РФ
+        :return: None
+        """
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.fill()
 
-    def reset(self):
-        self._data_write_only = []
-        self._data_read_only = []
-        self._cached_date = None
+    def refresh(self):
+        """
+        просит фоновый поток обновить хранилище, не дожидаясь планового времени
+        :return: None
+        """
+        self._refresh_event.set()
+
+    def stop(self):
+        """
+        останавливает фоновый поток обновления; поток завершается после текущей итерации
+        :return: None
+        """
+        self._stop_event.set()
+        self._refresh_event.set()
+
+    def _refresh_loop(self):
+        """
+        цикл фонового потока: заполняет хранилище, если данных еще нет (и этого не сделал обработчик сообщения),
+        если сменилась дата или если обновление запрошено через refresh(). Плановая проверка выполняется
+        в RATES_REFRESH_OFFSET секунд после полуночи, но не реже раза в RATES_REFRESH_CHECK_INTERVAL секунд;
+        после сбоя попытка повторяется через RATES_REFRESH_RETRY_DELAY секунд. Завершается по stop()
+        :return: None
+        """
+        # версия снимка на момент запроса refresh(); если хранилище с тех пор обновилось, запрос уже выполнен
+        requested_version = None
+        while not self._stop_event.is_set():
+            # событие сбрасывается до заполнения, чтобы запрос refresh(), пришедший во время или после него, не потерялся
+            self._refresh_event.clear()
+            try:
+                with self._lock:
+                    snapshot = self._snapshot
+                    if snapshot.version == 0 or snapshot.version == requested_version \
+                            or RatesStorage.current_date() != snapshot.cached_date:
+                        self.fill()
+            except APIException:
+                timeout = RATES_REFRESH_RETRY_DELAY
+            else:
+                requested_version = None
+                timeout = min(RatesStorage.seconds_until_refresh(), RATES_REFRESH_CHECK_INTERVAL)
+
+            if self._refresh_event.wait(timeout):
+                requested_version = self._snapshot.version
 
     @staticmethod
     def get_vocabulary():
@@ -170,13 +302,13 @@ class RatesStorage:
         result = {}
 
         try:
-            response = requests.get(CURRENCIES_VOC_URL).text
-            tree = ETree.fromstring(response)
-            for item in tree.iter("Item"):
+            response = _HTTP.get(CURRENCIES_VOC_URL, timeout=HTTP_TIMEOUT).content
+            for _, item in etree.iterparse(BytesIO(response), tag="Item"):
                 id = item.get("ID")
                 rus_name = item.find("Name").text
                 eng_name = item.find("EngName").text
                 result[id] = {"rus_name": rus_name, "eng_name": eng_name}
+                item.clear()
         except requests.RequestException as e:
             raise APIException(f"Ошибка! Не удалось получить справочник валют с сайта {CURRENCIES_VOC_URL} ({type(e).__name__})")
         except Exception as e:
@@ -187,81 +319,170 @@ class RatesStorage:
 
     def fill(self):
         """
-        заполняет хранилище данными с сайта ЦБ РФ, используя словарь валют
+        заполняет хранилище данными с сайта ЦБ РФ, используя словарь валют;
+        новый снимок публикуется только после успешного разбора, поэтому до этого момента
+        читатели видят прежние данные
         :return: None
         """
-        self.reset()
-        self._cached_date = RatesStorage.current_date()
+        cached_date = RatesStorage.current_date()
 
-        requested_url = f"{RATES_URL_PREFIX}{self._cached_date}"
+        requested_url = f"{RATES_URL_PREFIX}{cached_date}"
         vocabulary = RatesStorage.get_vocabulary()
 
         try:
-            response = requests.get(requested_url).text
-            tree = ETree.fromstring(response)
+            response = _HTTP.get(requested_url, timeout=HTTP_TIMEOUT).content
 
-            for item in tree.iter('Valute'):
+            data = []
+            for _, item in etree.iterparse(BytesIO(response), tag='Valute'):
                 id = item.get("ID")
                 currency_data = vocabulary[id]
                 currency_data["code"] = item.find("CharCode").text
                 currency_data["rub_rate"] = float(item.find("VunitRate").text.replace(",", "."))
-                self._data_write_only.append(currency_data)
+                data.append(currency_data)
+                item.clear()
 
             # искусственнно дополняем данные российским рублём
-            self._data_write_only.append({
+            data.append({
                 "code": "RUR",
                 "rus_name": "Российский рубль",
                 "eng_name": "Russian Ruble",
                 "rub_rate": 1.0
             })
 
-            self._data_read_only = copy.deepcopy(self._data_write_only)
+            # заранее приводим названия к нижнему регистру, чтобы не делать этого при каждом запросе;
+            # короткие коды валют интернируются, чтобы их сравнение сводилось к сравнению ссылок
+            for currency_data in data:
+                currency_data["code"] = sys.intern(currency_data["code"])
+                currency_data["_code_lower"] = sys.intern(currency_data["code"].lower())
+                currency_data["_rus_lower"] = currency_data["rus_name"].lower()
+                currency_data["_eng_lower"] = currency_data["eng_name"].lower()
+
+            # замораживаем записи и их набор, чтобы data можно было отдавать наружу без копирования
+            data = tuple(MappingProxyType(currency_data) for currency_data in data)
+
+            # индексы для поиска за O(1): по коду и по любому из названий в нижнем регистре;
+            # при совпадении ключей выигрывает валюта, идущая в списке раньше
+            index = {}
+            by_code = {}
+            for currency_data in data:
+                by_code.setdefault(currency_data["code"], currency_data)
+                for key in (currency_data["_code_lower"], currency_data["_rus_lower"], currency_data["_eng_lower"]):
+                    index.setdefault(key, currency_data)
+
+            # плоский список названий для нечеткого поиска, валюты, которым они принадлежат, и их позиции в data;
+            # сортировка по длине позволяет сразу отсечь названия, чья длина отличается от запроса
+            # больше, чем на MAX_LEV_DISTANCE (расстояние Левенштейна не меньше разницы длин);
+            # при равной длине сохраняется порядок data (русское название перед английским)
+            pairs = []
+            for position, currency_data in enumerate(data):
+                pairs.append((currency_data["_rus_lower"], position, currency_data))
+                pairs.append((currency_data["_eng_lower"], position, currency_data))
+            pairs.sort(key=lambda pair: (len(pair[0]), pair[1]))
+            fuzzy_choices = [name for name, _, _ in pairs]
+            fuzzy_owners = [currency_data for _, _, currency_data in pairs]
+            fuzzy_positions = [position for _, position, _ in pairs]
+            fuzzy_lengths = [len(name) for name, _, _ in pairs]
+
+            # тексты для команд /values и /rates меняются только вместе с данными
+            vocabulary_text = "\n".join([
+                'СПРАВОЧНИК ВАЛЮТ',
+                '(Код валюты, русское и английское названия)',
+                '-----------------------------------------------------------',
+                *(f"{item['code']}, {item['rus_name']}, {item['eng_name']}" for item in data),
+                '-----------------------------------------------------------',
+                "Чтобы вывести справку, наберите /start или /help",
+            ])
+            rates_text = "\n".join([
+                f'КОТИРОВКИ ВАЛЮТ ЦБ РФ на {cached_date}',
+                '(Код валюты, курс руб/ед.)',
+                '-----------------------------------------------------------',
+                *(f"{item['code']}, {item['rub_rate']}" for item in data),
+                '-----------------------------------------------------------',
+                "Чтобы вывести справку, наберите /start или /help",
+            ])
         except requests.RequestException as e:
             raise APIException(f"Ошибка! Не удалось получить информацию о курсах валют с сайта {requested_url} ({type(e).__name__})")
         except Exception as e:
             raise APIException(f"Ошибка! Не удалось разобрать XML, полученный с сайта {requested_url} ({type(e).__name__})")
 
-    def find_currency_by_code(self, code: str) -> dict:
+        # публикация одним присваиванием: читатели получают либо прежний снимок, либо новый целиком
+        self._snapshot = RatesSnapshot(
+            data=data,
+            index=index,
+            by_code=by_code,
+            fuzzy_choices=fuzzy_choices,
+            fuzzy_owners=fuzzy_owners,
+            fuzzy_positions=fuzzy_positions,
+            fuzzy_lengths=fuzzy_lengths,
+            vocabulary_text=vocabulary_text,
+            rates_text=rates_text,
+            cached_date=cached_date,
+            version=self._snapshot.version + 1,
+        )
+        # записи кэшей ссылаются на прежний снимок; очищаем их, чтобы не удерживать старые данные в памяти
+        RatesStorage._fuzzy_lookup.cache_clear()
+        API._format_quote.cache_clear()
+
+    def find_currency_by_code(self, code: str, snapshot: RatesSnapshot = None) -> dict:
         """
         находит валюту по ее коду
         :param code: str
-        :return: dict('rus_name': str, 'eng_name': str, 'code': str, 'rub_rate': float)
+        :param snapshot: снимок данных, в котором ищется валюта (по умолчанию текущий)
+        :return: MappingProxyType('rus_name': str, 'eng_name': str, 'code': str, 'rub_rate': float,
+            а также служебные '_code_lower', '_rus_lower', '_eng_lower': str - названия в нижнем регистре)
         """
-        filtered = list(filter(lambda currency: currency["code"] == code, self.data))
-        return None if len(filtered) == 0 else filtered[0]
+        if snapshot is None:
+            snapshot = self.snapshot
+        return snapshot.by_code.get(code)
 
-    def get_currency_data(self, request: str) -> dict:
+    def get_currency_data(self, request: str, snapshot: RatesSnapshot = None) -> dict:
         """
         возвращает информацию о запрашиваемой валюте
         1) пытается найти валюту по строгому соответствию трёхбуквенного кода, английского или русского названий
         2) если п. 1 не сработал, ищет валюту по расстоянию Левенштейна, сопоставляя запрос с английским и русским названиям
         :param request: код валюты либо ее название
-        :return: dict('rus_name': str, 'eng_name': str, 'code': str, 'rub_rate': float)
+        :param snapshot: снимок данных, в котором ищется валюта (по умолчанию текущий)
+        :return: MappingProxyType('rus_name': str, 'eng_name': str, 'code': str, 'rub_rate': float,
+            а также служебные '_code_lower', '_rus_lower', '_eng_lower': str - названия в нижнем регистре)
         """
+        if snapshot is None:
+            snapshot = self.snapshot
 
-        def equality_comparator(currency, request):
-            """
-            собственно функция-компаратор для поиска валюты
-            :param currency: dict
-            :param request: str
-            :return: boolean
-            """
-            lower_request = request.lower()
-            return currency["code"].lower() == lower_request or \
-                currency["rus_name"].lower() == lower_request or \
-                    currency["eng_name"].lower() == lower_request
+        lower_request = request.lower()
+        currency = snapshot.index.get(lower_request)
+        if currency is not None:
+            return currency
 
-        equality_filtered = list(filter(lambda currency: equality_comparator(currency, request), self.data))
+        return RatesStorage._fuzzy_lookup(lower_request, snapshot)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _fuzzy_lookup(lower_request: str, snapshot: RatesSnapshot) -> dict:
+        """
+        ищет валюту по расстоянию Левенштейна, сопоставляя запрос с английским и русским названиями;
+        при равном расстоянии выбирается валюта, идущая в data раньше;
+        результат кэшируется по запросу и снимку (снимки сравниваются по идентичности),
+        кэш очищается при публикации нового снимка, см. fill()
+        :param lower_request: запрос в нижнем регистре
+        :param snapshot: снимок данных, в котором ищется валюта
+        :return: MappingProxyType('rus_name': str, 'eng_name': str, 'code': str, 'rub_rate': float,
+            а также служебные '_code_lower', '_rus_lower', '_eng_lower': str - названия в нижнем регистре)
+        """
+        request_length = len(lower_request)
+        lo = bisect_left(snapshot.fuzzy_lengths, request_length - MAX_LEV_DISTANCE)
+        hi = bisect_right(snapshot.fuzzy_lengths, request_length + MAX_LEV_DISTANCE)
 
-        if (len(equality_filtered)):
-            return equality_filtered[0]
+        # список отсортирован по длине, а не по порядку валют, поэтому среди всех названий с минимальным
+        # расстоянием победителя выбираем по позиции валюты в data, а не по первому найденному
+        matches = process.extract(lower_request, snapshot.fuzzy_choices[lo:hi],
+                                  scorer=Levenshtein.distance, score_cutoff=MAX_LEV_DISTANCE, limit=None)
+        if not matches:
+            return None
 
-        lev_distances = []
-        for currency in self.data:
-            rus_distance = distance(currency["rus_name"].lower(), request.lower())
-            eng_distance = distance(currency["eng_name"].lower(), request.lower())
-            lev_distances.append({"code": currency["code"], "distance": min(rus_distance, eng_distance)})
-        lev_distances.sort(key=lambda x:x["distance"])
+        _, _, best = min(matches, key=lambda match: (match[1], snapshot.fuzzy_positions[lo + match[2]]))
+        return snapshot.fuzzy_owners[lo + best]
 
-        return self.find_currency_by_code(lev_distances[0]["code"]) if lev_distances[0]["distance"] <= 3 else None
 
+# единственное хранилище курсов, общее для всех обработчиков бота; фоновый поток начинает
+# заполнять его с сайта ЦБ РФ сразу при импорте модуля
+STORAGE = RatesStorage()
@@ -7,3 +7,17 @@ CURRENCIES_VOC_URL  = 'https://www.cbr.ru/scripts/XML_val.asp'
 # префикс URL для запроса курсов с сайта ЦБ РФ на заданную дату
 RATES_URL_PREFIX  = 'https://www.cbr.ru/scripts/XML_daily.asp?date_req='
 
+# таймаут (в секундах) запросов к сайту ЦБ РФ
+HTTP_TIMEOUT = 5
+
+# число потоков, обрабатывающих входящие сообщения (ограничено с учетом лимита Telegram ~30 сообщений/с)
+BOT_NUM_THREADS = 8
+
+# время ежедневного обновления курсов (в секундах после локальной полуночи)
+RATES_REFRESH_OFFSET = 5 * 60
+
+# пауза (в секундах) перед повторной попыткой обновления курсов после сбоя
+RATES_REFRESH_RETRY_DELAY = 60
+
+# максимальный интервал (в секундах) между проверками фоновым потоком смены даты
+RATES_REFRESH_CHECK_INTERVAL = 60 * 60